@@ -6,9 +6,18 @@ import ssl
 # since SMTP is limited to 7-bit ASCII, 
 # we need to base64 encode any binary data (attachments like videos, pdfs, etc.) that exceeds limit (8-bit, etc.)
 # so that we can send it properly through protocol and MIME code
-import base64
+# pybase64 (optional, pip install pybase64) wraps libbase64 and uses SIMD (SSSE3/AVX2/AVX-512) kernels picked at runtime,
+# which is several times faster than the stdlib encoder on big attachments; same API so we fall back to stdlib if missing
+try:
+    import pybase64 as _b64
+except ImportError:
+    import base64 as _b64
+# guess each attachment's content type from its file extension
+import mimetypes
 # for tcp connections and messing with sockets (low-level networking API)
 import socket
+# spooled temp file to hold the encoded message before sending it
+import tempfile
 # for loading in the .env file used
 from dotenv import load_dotenv
 
@@ -58,6 +67,23 @@ Aerobrid
 """
 
 # ================= MIME MESSAGE FORMATTING =================
+# base64 turns every 3 input bytes into 4 output chars, so 57 raw bytes -> one 76 char line (the MIME line length limit)
+LINE_BYTES = 57
+# how many lines worth of file we read + encode at once (~56 KiB per read, keeps memory flat for huge files)
+LINES_PER_READ = 1024
+
+# stream a file as CRLF-terminated base64 lines instead of reading + encoding the whole thing into one giant string
+# this is a generator, so only one block of the file is in memory at a time
+def encode_attachment(filepath):
+    with open(filepath, "rb") as f:
+        while True:
+            chunk = f.read(LINE_BYTES * LINES_PER_READ)
+            if not chunk:
+                break
+            encoded = _b64.b64encode(chunk)
+            # wrap the encoded block into 76 char lines
+            yield b"".join(encoded[i:i + 76] + b"\r\n" for i in range(0, len(encoded), 76))
+
 boundary = "BOUNDARY123"                                     # boundary = text/attachments separator in MIME (to handle multipart messages)
 msg = f"""From: {gmail_user}                                 
 To: {recipient}                                             
@@ -71,118 +97,180 @@ Content-Type: text/plain; charset="utf-8"
 """
 # Content-Type needs to know what the boundary name is so it can read it after the "--"
 
+# the message is kept as a list of parts (each one an iterable of byte chunks) rather than one big string
+# so attachments are streamed piece by piece
+message_parts = [[msg.encode()]]
+
 # attach all the files from 'attachments' folder to our msg
 attachments_dir = "attachments"
 if os.path.exists(attachments_dir) and os.path.isdir(attachments_dir):
     # loop through files
-    for filename in os.listdir(attachments_dir):
-        filepath = os.path.join(attachments_dir, filename)
-        # check if file valid
-        if os.path.isfile(filepath):
-            # read file in binary mode for: binary data -> base64encode -> ASCII bytes -> ASCII string
-            # return a string with .decode() ('aG8', not b'aG8') 
-            with open(filepath, "rb") as f:
-                encoded_file = base64.b64encode(f.read()).decode()
-            # infer content type (ctype) based on file extension (simplified)
-            if filename.lower().endswith((".jpg", ".jpeg")):
-                ctype = "image/jpeg"
-            elif filename.lower().endswith(".png"):
-                ctype = "image/png"
-            elif filename.lower().endswith(".gif"):
-                ctype = "image/gif"
-            else:
-                ctype = "application/octet-stream"
-
-            msg += f"""
+    # scandir() hands back the file type along with each name from the directory read itself,
+    # so checking is_file() doesn't need an extra stat() call per file like os.path.isfile() does
+    with os.scandir(attachments_dir) as entries:
+        for entry in entries:
+            # check if file valid
+            if not entry.is_file():
+                continue
+            filename = entry.name
+            filepath = entry.path
+            # infer content type (ctype) based on file extension
+            # mimetypes does a single table lookup on the extension and knows far more types than we'd list by hand
+            ctype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+            message_parts.append([f"""
 --{boundary}
 Content-Type: {ctype}; name="{filename}"
 Content-Transfer-Encoding: base64
 Content-Disposition: attachment; filename="{filename}"
 
-{encoded_file}
-"""
+""".encode()])
+            # read file in binary mode for: binary data -> base64encode -> ASCII bytes (lazily, see encode_attachment)
+            message_parts.append(encode_attachment(filepath))
 
 # End MIME multipart message
-msg += f"\r\n--{boundary}--\r\n"
+message_parts.append([f"\r\n--{boundary}--\r\n".encode()])
+
+# write the encoded message out to a spooled temp file (kept in RAM up to 1 MiB, then rolls over to disk)
+# so we can hand it to socket.sendfile() later instead of building one giant bytes object
+# (on a plain TCP socket sendfile() uses the os.sendfile() syscall, over TLS it falls back to a fixed size copy loop)
+message_file = tempfile.SpooledTemporaryFile(max_size=1 << 20)
+for part in message_parts:
+    for chunk in part:
+        message_file.write(chunk)
+message_file.seek(0)
+
 # SMTP terminator for message content (the period ends the DATA phase)
 endmsg = "\r\n.\r\n"
 
 # ================= SMTP CONNECTION =================
+# reads SMTP replies off a socket line by line (like Twisted's LineReceiver)
+# recv(1024) alone can cut a multi-line reply in half or, with pipelining, return several replies at once,
+# so we keep a buffer of bytes that haven't been handed out yet and only return complete replies
+class SMTPReader:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        # reusable scratch space for recv_into(), so each read doesn't allocate a new bytes object
+        # (an explicit memoryview also keeps PyPy from copying the buffer on every call)
+        self.scratch = memoryview(bytearray(4096))
+
+    # read ONE full reply and return it as a list of (code, text) tuples, one per line
+    # per RFC 5321 every line of a multi-line reply looks like "250-..." and the last one looks like "250 ..."
+    def read_reply(self):
+        lines = []
+        while True:
+            end = self.buffer.find(b"\r\n")
+            if end == -1:
+                n = self.sock.recv_into(self.scratch)
+                if not n:
+                    raise ConnectionError("Server closed the connection")
+                self.buffer.extend(self.scratch[:n])
+                continue
+            line = self.buffer[:end].decode()
+            del self.buffer[:end + 2]
+            lines.append((int(line[:3]), line[4:]))
+            # a space (or nothing) after the 3 digit code means this is the last line of the reply
+            if line[3:4] != "-":
+                return lines
+
+# turn a parsed reply back into readable text for the terminal logs
+def format_reply(reply):
+    return "\n".join(f"{code} {text}" for code, text in reply)
+
 # hostname and port to connect to
 mailserver = ("smtp.gmail.com", 587)
 clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# SMTP commands are short lines, so turn off Nagle's algorithm (TCP_NODELAY) so they go out right away
+# and turn on keepalive so a dead connection gets noticed (both carry over to the TLS wrapped socket)
+clientSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+clientSocket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
 clientSocket.connect(mailserver)
 # print out mailserver greeting to terminal FROM BYTES -> STRING 
 # Reminder: all client-server communication here happens over TCP sockets using bytes
-# IMPROVEMENT: you can call a helper to read SMTP reply correctly instead of reading 1st 1024 bytes
-print("[+] Connected to server:", clientSocket.recv(1024).decode())
+reader = SMTPReader(clientSocket)
+print("[+] Connected to server:", format_reply(reader.read_reply()))
 
 # EHLO (Extended Hello) tells the mail server: “Hello, I’m an SMTP client.”
 # The server responds with its capabilities (CHUNKING, PIPELINING, SIZE, STARTTLS, etc.)
 clientSocket.send(b"EHLO Aerobrid\r\n")
-print("[+] EHLO:", clientSocket.recv(1024).decode())
+print("[+] EHLO:", format_reply(reader.read_reply()))
 
 # STARTTLS (ask the mailserver for TLS encryption upgrade)
 # print server response (220 OK)
 clientSocket.send(b"STARTTLS\r\n")
-print("[+] STARTTLS:", clientSocket.recv(1024).decode())
+print("[+] STARTTLS:", format_reply(reader.read_reply()))
 
 # Wrap socket in TLS
+# new reader on the TLS socket, anything buffered from before the handshake must not be trusted afterwards
 context = ssl.create_default_context()
 clientSocket = context.wrap_socket(clientSocket, server_hostname="smtp.gmail.com")
+reader = SMTPReader(clientSocket)
 
 # EHLO again after TLS to identify user as SMTP client
 # this is needed again because the SMTP session is reset to initial state following the TLS handshake
 # print server response
 clientSocket.send(b"EHLO Aerobrid\r\n")
-print("[+] EHLO (TLS):", clientSocket.recv(1024).decode())
+ehlo_reply = reader.read_reply()
+print("[+] EHLO (TLS):", format_reply(ehlo_reply))
+# capability keywords are the first word of each line after the greeting line (ex: "250-PIPELINING")
+capabilities = {text.split(" ")[0].upper() for code, text in ehlo_reply[1:]}
 
 # AUTH LOGIN
 # The order this process goes in:
-# 1. you send an AUTH LOGIN SMTP command to server and then in return it expects credentials in base64 format
-# 2. the server asks for valid client email and password with corresponding 334 codes
+# 1. you send an AUTH LOGIN SMTP command to server along with the base64 email address as the "initial response" (RFC 4954)
+#    which saves a round trip compared to waiting for the server to ask for it
+# 2. the server asks for the password with a 334 code
 # 3. provide them through proper conversion: original string -> UTF-8 encoding (ASCII backwards-compatible) -> binary data -> base64encode -> ASCII bytes 
 # 4. passes if server replies with: 235 - Authentication successful
 # print server response
-clientSocket.send(b"AUTH LOGIN\r\n")
-print("[+] AUTH:", clientSocket.recv(1024).decode())
+clientSocket.send(b"AUTH LOGIN " + _b64.b64encode(gmail_user.encode('utf-8')) + b"\r\n")
+print("[+] AUTH:", format_reply(reader.read_reply()))
 
-clientSocket.send(base64.b64encode(gmail_user.encode()) + b"\r\n")
-print("[+] USER:", clientSocket.recv(1024).decode())
-
-clientSocket.send(base64.b64encode(app_password.encode()) + b"\r\n")
-auth_reply = clientSocket.recv(1024).decode()
-print("[+] PASS:", auth_reply)
-if not auth_reply.startswith("235"):
+clientSocket.send(_b64.b64encode(app_password.encode('utf-8')) + b"\r\n")
+auth_reply = reader.read_reply()
+print("[+] PASS:", format_reply(auth_reply))
+if auth_reply[-1][0] != 235:
     raise Exception("Authentication failed! Check your Gmail app password.")
 
 # MAIL FROM SMTP command specifies the sender (client) email address
-# print server response (250 OK)
-clientSocket.send(f"MAIL FROM:<{gmail_user}>\r\n".encode())
-print("[+] MAIL FROM:", clientSocket.recv(1024).decode())
-
 # RCPT TO SMTP command specifies what the destination email address is
-# print server response (250 OK)
-clientSocket.send(f"RCPT TO:<{recipient}>\r\n".encode())
-print("[+] RCPT TO:", clientSocket.recv(1024).decode())
-
 # DATA SMTP command tells server if it is okay now to send mail data
+envelope = [
+    f"MAIL FROM:<{gmail_user}>\r\n".encode(),
+    f"RCPT TO:<{recipient}>\r\n".encode(),
+    b"DATA\r\n",
+]
+if "PIPELINING" in capabilities:
+    # the server lets us send all three commands at once (RFC 2920) and then read the replies back in order
+    # so this costs one round trip instead of three
+    clientSocket.sendall(b"".join(envelope))
+    replies = [reader.read_reply() for _ in envelope]
+else:
+    replies = []
+    for command in envelope:
+        clientSocket.send(command)
+        replies.append(reader.read_reply())
+
+# print server responses (250 OK, 250 OK, 354 Go ahead)
+print("[+] MAIL FROM:", format_reply(replies[0]))
+print("[+] RCPT TO:", format_reply(replies[1]))
 # if its okay (reply back is a 354 Go ahead), we send out msg and the final line containing "." to end mail data transfer
-# print server response (250 OK)
-clientSocket.send(b"DATA\r\n")
-data_reply = clientSocket.recv(1024).decode()
-print("[+] DATA:", data_reply)
-if not data_reply.startswith("354"):
+data_reply = replies[2]
+print("[+] DATA:", format_reply(data_reply))
+if data_reply[-1][0] != 354:
     raise Exception("Server is not ready for DATA phase of SMTP connection")
 
-clientSocket.sendall(msg.encode())
+# send the spooled message in one go, then the terminator
+clientSocket.sendfile(message_file)
+message_file.close()
 clientSocket.send(endmsg.encode())
-print("[+] MESSAGE SENT:", clientSocket.recv(1024).decode())
+print("[+] MESSAGE SENT:", format_reply(reader.read_reply()))
 
 # QUIT SMTP command sends a request to end the SMTP connection
 # server must reply back with a "221 OK"
 clientSocket.send(b"QUIT\r\n")
-print("[+] QUIT:", clientSocket.recv(1024).decode())
+print("[+] QUIT:", format_reply(reader.read_reply()))
 
 # close the socket  
 clientSocket.close()
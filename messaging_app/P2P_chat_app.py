@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 """
-p2p_chat_app.py - peer-to-peer chat using TCP sockets and threading
+p2p_chat_app.py - peer-to-peer chat using TCP sockets and a selectors event loop
+(falls back to threading on Windows, where stdin can't be used with select,
+and whenever stdin isn't a terminal, e.g. a file or pipe)
 
 Usage:
   To listen/wait for a connection:
@@ -11,11 +13,16 @@ Usage:
 """
 
 import socket
+# single-threaded event loop: wait on the socket and stdin at the same time
+import selectors
+# only used for the Windows fallback
 import threading
 # for required arguments when calling program
 import argparse
 # reading stdin
 import sys
+# raw reads from the stdin fd
+import os
 import time
 
 # message delimiter
@@ -23,36 +30,45 @@ DELIM = b'\n'
 # how many bytes to read from socket
 BUFFER_SIZE = 4096
 
-# for receiving peer msg
+# print out every complete msg sitting in the buffer and remove it from the buffer
+# whatever is left over is a partial msg that will be finished by a later recv
+def print_messages(buffer: bytearray, remote_name: str):
+    while True:
+        # check if you delimiter is there
+        idx = buffer.find(DELIM)
+        if idx == -1:
+            break
+        # extract
+        raw = buffer[:idx]
+        # move buffer (deletes the consumed msg in place)
+        del buffer[:idx + len(DELIM)]
+        # try and decode output
+        try:
+            text = raw.decode('utf-8', errors='replace')
+        except Exception:
+            text = "<unreadable>"
+        # print out the msg on new line even if user is typing
+        print(f"\n{remote_name}: {text}")
+        print("> ", end='', flush=True)
+
+# for receiving peer msg (thread version, used on Windows / non-terminal stdin)
 def recv_loop(conn: socket.socket, remote_name: str):
     # this loop accumulates bytes until hitting the delimiter
     # you log status and break accordingly in loop, also add to binary data "buffer" variable
-    buffer = b''
+    # bytearray (mutable) instead of bytes so appending/removing doesn't copy the whole buffer every time
+    buffer = bytearray()
+    # scratch space allocated once and reused for every recv (recv_into writes straight into it)
+    scratch = bytearray(BUFFER_SIZE)
+    mv = memoryview(scratch)
     try:
         while True:
-            data = conn.recv(BUFFER_SIZE)
-            if not data:
+            n = conn.recv_into(mv)
+            if n == 0:
                 print("\n[System] Remote peer disconnected.")
                 break
             # can arrive in chunks
-            buffer += data
-            while True:
-                # check if you delimiter is there
-                idx = buffer.find(DELIM)
-                if idx == -1:
-                    break
-                # extract
-                raw = buffer[:idx]
-                # move buffer
-                buffer = buffer[idx + len(DELIM):]
-                # try and decode output
-                try:
-                    text = raw.decode('utf-8', errors='replace')
-                except Exception:
-                    text = "<unreadable>"
-                # print out the msg on new line even if user is typing
-                print(f"\n{remote_name}: {text}")
-                print("> ", end='', flush=True)
+            buffer.extend(mv[:n])
+            print_messages(buffer, remote_name)
     # bind whatever error thrown to e (common practice)
     except Exception as e:
         print(f"\n[System] Receive error: {e}")
@@ -64,9 +80,11 @@ def recv_loop(conn: socket.socket, remote_name: str):
         except Exception:
             pass
 
-# 
+# for sending your msgs (thread version, used on Windows / non-terminal stdin)
 def send_loop(conn: socket.socket, my_name: str):
     # read from stdin (standard input) and send messages; use newline delimiting
+    # the "name: " part never changes, so encode it once up front
+    prefix = (my_name + ": ").encode('utf-8')
     try:
         while True:
             # format (flush=True means write text to terminal immediately)
@@ -82,8 +100,8 @@ def send_loop(conn: socket.socket, my_name: str):
             if text.lower() == "/quit":
                 print("[System] Quitting and closing connection...")
                 break
-            # msg formatting
-            payload = f"{my_name}: {text}".encode('utf-8') + DELIM
+            # msg formatting (join builds the final bytes in one allocation)
+            payload = b''.join((prefix, text.encode('utf-8', 'replace'), DELIM))
             # send your msg
             conn.sendall(payload)
     # catch any errors
@@ -96,6 +114,107 @@ def send_loop(conn: socket.socket, my_name: str):
         except Exception:
             pass
 
+# selector callback for when the socket has data, returns False once the peer is gone
+def _handle_sock(conn: socket.socket, remote_name: str, buffer: bytearray, mv: memoryview) -> bool:
+    n = conn.recv_into(mv)
+    if n == 0:
+        print("\n[System] Remote peer disconnected.")
+        return False
+    buffer.extend(mv[:n])
+    print_messages(buffer, remote_name)
+    return True
+
+# send every complete line sitting in the stdin buffer and remove it from the buffer (same idea as print_messages)
+# returns False if the user typed "/quit"
+def send_lines(conn: socket.socket, prefix: bytes, in_buffer: bytearray) -> bool:
+    while True:
+        idx = in_buffer.find(DELIM)
+        if idx == -1:
+            return True
+        text = bytes(in_buffer[:idx])
+        del in_buffer[:idx + len(DELIM)]
+        # user can terminate session with "/quit"
+        if text.lower() == b"/quit":
+            print("[System] Quitting and closing connection...")
+            return False
+        # msg formatting (join builds the final bytes in one allocation)
+        # the typed bytes are sent as they are, no decode/encode round trip
+        conn.sendall(b''.join((prefix, text, DELIM)))
+
+# selector callback for when something was typed, returns False when the user is done
+# reads the raw fd instead of sys.stdin.readline(): readline() could pull several lines into python's own
+# buffer but hand back only the first, and the rest would sit there with the fd never becoming readable again
+def _handle_stdin(conn: socket.socket, prefix: bytes, in_buffer: bytearray) -> bool:
+    data = os.read(sys.stdin.fileno(), BUFFER_SIZE)
+    if not data:
+        # EOF, a last line without a newline still gets sent
+        if in_buffer:
+            in_buffer.extend(DELIM)
+            send_lines(conn, prefix, in_buffer)
+        return False
+    in_buffer.extend(data)
+    if not send_lines(conn, prefix, in_buffer):
+        return False
+    print("> ", end='', flush=True)
+    return True
+
+# one thread handles both directions: the selector (epoll/kqueue/etc. depending on OS)
+# wakes us up whenever the socket or stdin has something to read
+# returns False without doing anything if stdin can't be watched by the selector (caller uses threads then)
+def select_loop(conn: socket.socket, remote_name: str, my_name: str) -> bool:
+    sel = selectors.DefaultSelector()
+    try:
+        sel.register(sys.stdin, selectors.EVENT_READ)
+    # e.g. epoll refuses regular files and /dev/null (EPERM)
+    except (OSError, ValueError):
+        sel.close()
+        return False
+    sel.register(conn, selectors.EVENT_READ)
+    # same receive buffers as recv_loop, they just live here now between callbacks
+    buffer = bytearray()
+    # typed bytes that don't make up a full line yet
+    in_buffer = bytearray()
+    scratch = bytearray(BUFFER_SIZE)
+    mv = memoryview(scratch)
+    # the "name: " part never changes, so encode it once up front
+    prefix = (my_name + ": ").encode('utf-8')
+    print("> ", end='', flush=True)
+    try:
+        running = True
+        while running:
+            for key, _ in sel.select():
+                if key.fileobj is conn:
+                    running = _handle_sock(conn, remote_name, buffer, mv)
+                else:
+                    running = _handle_stdin(conn, prefix, in_buffer)
+                if not running:
+                    break
+    except Exception as e:
+        print(f"\n[System] Error: {e}")
+    finally:
+        sel.close()
+        # done in both directions
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+    return True
+
+# one thread per direction: used on Windows (stdin isn't selectable there) and when stdin is a file or pipe
+def thread_chat(conn: socket.socket, remote_name: str, my_name: str):
+    # start receiving thread (to receive messages while dishing them out)
+    recv_t = threading.Thread(target=recv_loop, args=(conn, remote_name), daemon=True)
+    recv_t.start()
+
+    # start sender loop (runs in main/initial thread so stdin works)
+    send_loop(conn, my_name)
+
+# chat msgs are tiny, so turn off Nagle's algorithm (TCP_NODELAY) which would otherwise hold them back
+# waiting to batch them with more data, and turn on keepalive so a dead peer is eventually noticed
+def set_chat_sockopts(conn: socket.socket):
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
 # create tcp listening socket helper function
 def run_listener(port: int, my_name: str):
     # steps similar to previous projects
@@ -105,6 +224,7 @@ def run_listener(port: int, my_name: str):
     s.listen(1)
     print(f"[System] Listening on port {port} — waiting for one peer...")
     conn, addr = s.accept()
+    set_chat_sockopts(conn)
     print(f"[System] Connected by {addr[0]}:{addr[1]}")
     s.close()
     return conn, f"{addr[0]}"
@@ -114,6 +234,7 @@ def run_connector(host: str, port: int):
     # similar setup but we are connecting to listener (host) now
     # code here is basically like the client_socket you get from .accept() socket method except on client-side now
     conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    set_chat_sockopts(conn)
     print(f"[System] Connecting to {host}:{port} ...")
     conn.connect((host, port))
     print(f"[System] Connected to {host}:{port}")
@@ -143,12 +264,10 @@ def main():
         else:
             conn, remote = run_connector(args.host, args.port)
 
-        # start receiving thread (to receive messages while dishing them out)
-        recv_t = threading.Thread(target=recv_loop, args=(conn, remote), daemon=True)
-        recv_t.start()
-
-        # start sender loop (runs in main/initial thread so stdin works)
-        send_loop(conn, args.name)
+        # the event loop is only for an interactive terminal on non-Windows systems,
+        # anything else (Windows, stdin redirected from a file/pipe, or a selector that refuses stdin) uses threads
+        if sys.platform == "win32" or not sys.stdin.isatty() or not select_loop(conn, remote, args.name):
+            thread_chat(conn, remote, args.name)
     # error or exit detected
     except KeyboardInterrupt:
         print("\n[System] KeyboardInterrupt — exiting.")
@@ -1,8 +1,16 @@
 import socket
 import sys
-# to handle each client connection in a separate thread
+# to handle each client connection on a pool of reusable threads
+from concurrent.futures import ThreadPoolExecutor
+# lock for the DNS cache shared between those threads
 import threading
+# timestamps for DNS cache expiry
+import time
 import os
+# waiting on sockets with a timeout while splicing
+import select
+# for turning URLs into cache filenames
+import hashlib
 # for URL breakdown into parts
 from urllib.parse import urlparse
 
@@ -11,38 +19,137 @@ Multithreaded HTTP Proxy Server
 ---------------------------------------
 - Accepts client HTTP requests and forwards them to the destination web server
 - Caches GET responses locally for faster subsequent access 
-- Handles concurrent client connections via python threading mpdule
+- Handles concurrent client connections via a pool of worker threads
 - Supports basic HTTP error handling and graceful shutdown
 """
 
 
+# max number of clients handled at the same time (extra connections wait in the pool's queue)
+MAX_WORKERS = 64
+
+# request headers we don't forward to the remote server (lowercase, compared against the start of each header line)
+STRIP_HEADERS = (b"proxy-connection:", b"connection:", b"host:", b"user-agent:")
+
+# how many bytes we move at a time when splicing the remote server's response (the default pipe capacity)
+RELAY_CHUNK = 65536
+# receive buffer size (both the kernel's SO_RCVBUF and our recv_into() buffer) for the remote server socket
+# bigger reads mean far fewer recv syscalls on large responses
+RECV_BUFFER = 1 << 18
+
+# seconds a client can sit idle (not sending its request / not reading our reply) before we drop it,
+# so a stuck connection can't keep a pool thread (and shutdown) waiting forever
+CLIENT_TIMEOUT = 5.0
+# same for the remote server (connecting, and going quiet in the middle of its response)
+SERVER_TIMEOUT = 10.0
+
+
+# how long (seconds) a resolved hostname stays in the DNS cache
+DNS_TTL = 60
+# hostname -> (IP address, time it was looked up)
+dns_cache = {}
+dns_lock = threading.Lock()
+
+
+# gethostbyname() with a small cache in front, a page usually pulls many assets from the same few hosts
+# so most lookups skip the (milliseconds long) DNS query; entries expire after DNS_TTL seconds
+def resolve(host):
+    now = time.monotonic()
+    with dns_lock:
+        entry = dns_cache.get(host)
+    if entry and now - entry[1] < DNS_TTL:
+        return entry[0]
+    # lookup happens outside the lock so one slow query doesn't hold up the other threads
+    ip = socket.gethostbyname(host)
+    with dns_lock:
+        dns_cache[host] = (ip, now)
+    return ip
+
+
+# relay everything from src socket to dst socket until src closes, without the bytes ever entering python
+# os.splice() (Linux, python 3.10+) moves data between file descriptors inside the kernel,
+# but one side has to be a pipe, so it goes: src socket -> pipe -> dst socket
+# both sockets have timeouts (so python keeps their fds non-blocking): splice() then fails with
+# BlockingIOError instead of waiting, and we wait for the socket ourselves up to its timeout
+def splice_relay(src, dst):
+    pipe_r, pipe_w = os.pipe()
+    try:
+        while True:
+            try:
+                n = os.splice(src.fileno(), pipe_w, RELAY_CHUNK)
+            except BlockingIOError:
+                wait_for_socket(src, write=False)
+                continue
+            if n == 0:
+                break
+            # drain the pipe into the destination socket
+            while n:
+                try:
+                    n -= os.splice(pipe_r, dst.fileno(), n)
+                except BlockingIOError:
+                    wait_for_socket(dst, write=True)
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+
+
+# wait until sock can be read from (or written to) within its timeout, raises socket.timeout otherwise
+def wait_for_socket(sock, write):
+    if write:
+        ready = select.select([], [sock], [], sock.gettimeout())[1]
+    else:
+        ready = select.select([sock], [], [], sock.gettimeout())[0]
+    if not ready:
+        raise socket.timeout("timed out")
+
+
+# portable version of splice_relay(): read into one reusable buffer and forward each chunk
+def copy_relay(src, dst):
+    scratch = bytearray(RECV_BUFFER)
+    mv = memoryview(scratch)
+    while True:
+        n = src.recv_into(mv)
+        if not n:
+            break
+        dst.sendall(mv[:n])
+
+
 # convert URL to safe filename for caching purposes
-def sanitize_filename(url):
-    return url.replace("/", "_").replace("?", "_").replace(":", "_")
+# hashing gives a fixed length name (no filesystem name length limits), never contains special characters,
+# and unlike swapping "/", "?" and ":" for "_" two different URLs can't end up with the same file
+def cache_filename(url):
+    return hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
 
 # handle each client connection (via multithreading in main loop)
 # proxy server acts as the middleman with behavior shown below in function
 def handle_client(client_sock, addr):
     print(f"[System] Connection from {addr}")
+    # set once any part of a response has gone out to the client, after that an error page would land in the middle of it
+    response_started = False
     try:
-        # read bytes into string (through UTF-8 decoding) sent in by the client (the user) 
+        # send replies to the browser right away instead of letting Nagle's algorithm hold small writes back
+        # (in here, not the accept loop, so a connection the client already reset can't take down the whole proxy)
+        client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # don't wait forever on a client that connects and never sends anything (browsers pre-open sockets like that)
+        client_sock.settimeout(CLIENT_TIMEOUT)
+
+        # read the raw bytes sent in by the client (the user), we keep it as bytes since a POST body can be binary
         # if nothing sent just close/quit
-        request = client_sock.recv(8192).decode()
-        if not request:
+        raw = client_sock.recv(8192)
+        if not raw:
             client_sock.close()
             return
 
-        # split request to lines based on CRLF's
-        # if no lines just close/quit
-        lines = request.split("\r\n")
-        if len(lines) == 0:
-            client_sock.close()
-            return
+        # split request into head (request line + headers) and body at the blank line,
+        # then the request line off the head, without walking/decoding the whole buffer
+        head, _, body = raw.partition(b"\r\n\r\n")
+        first_line, _, rest = head.partition(b"\r\n")
 
         # something like: GET http://host/path HTTP/1.1"
-        first_line = lines[0]
+        # only these small fields get decoded (a ValueError covers both a bad split and bad ASCII)
         try:
-            method, url, protocol = first_line.split()
+            method, url, protocol = first_line.split(b" ", 2)
+            method = method.decode("ascii")
+            url = url.decode("ascii")
         except ValueError:
             # if parsing that first http request line fails then we send back a 400 Bad Request and close/quit
             # .sendall() used in program to ensure that all bytes are sent; .send() sends up to specified bytes
@@ -53,7 +160,7 @@ def handle_client(client_sock, addr):
 
         # rest of lines within request are req headers
         # I want to see it (debug reasons), so logged into terminal (just like proxyServer and client connection logs)
-        headers = lines[1:]
+        headers = rest.split(b"\r\n") if rest else []
         print(f"[Request] {method} {url}")
 
         # remove leading slash if it exists (some browsers prepend a slash with the URL given)
@@ -75,31 +182,32 @@ def handle_client(client_sock, addr):
         CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
         os.makedirs(CACHE_DIR, exist_ok=True)
 
-        # set up file inside the cache folder with proper "sanitized" filename
-        cache_file = os.path.join(CACHE_DIR, sanitize_filename(url))
+        # set up file inside the cache folder with a hashed filename
+        cache_file = os.path.join(CACHE_DIR, cache_filename(url))
         print(f"[Cache] {cache_file}")
 
         # if GET HTTP method was read and cache file exists, we read its contents
         if method.upper() == "GET" and os.path.exists(cache_file):
             # called a "cache hit"
             print("[Cache] Hit")
+            response_started = True
             # rb -> read binary 
             with open(cache_file, "rb") as f:
-                response = f.read()
-            
-            # if body is missing minimal HTTP headers, add them in 
-            if not response.startswith(b"HTTP/"):
-                response = b"HTTP/1.0 200 OK\r\nContent-Type: text/html\r\n\r\n" + response
-
-            # send all bytes -> close socket
-            client_sock.sendall(response)
+                # if body is missing minimal HTTP headers, add them in 
+                # (only peek at the first few bytes to check)
+                if not f.read(5).startswith(b"HTTP/"):
+                    client_sock.sendall(b"HTTP/1.0 200 OK\r\nContent-Type: text/html\r\n\r\n")
+                f.seek(0)
+                # sendfile() lets the kernel copy the file straight to the socket (os.sendfile() where available)
+                # so the cached page never has to be read into python memory
+                client_sock.sendfile(f)
             client_sock.close()
             return
 
         # Connect to remote server client specifies
         try:
             # need the IP address for socket and TCP connection
-            server_ip = socket.gethostbyname(host)
+            server_ip = resolve(host)
         # dns lookup case
         except socket.gaierror:
             client_sock.sendall(b"HTTP/1.1 502 Bad Gateway\r\n\r\n")
@@ -108,58 +216,79 @@ def handle_client(client_sock, addr):
 
         # socket creation and tcp connection to remote server on port 80
         server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # set before connect() so the larger TCP window is advertised during the handshake
+        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+        server_sock.settimeout(SERVER_TIMEOUT)
         server_sock.connect((server_ip, 80))
 
-        # build HTTP request and ignore proxy-specific headers
-        request_line = f"{method} {path} HTTP/1.1\r\n"
-        forward_headers = ""
-        for header in headers:
-            if header.lower().startswith("proxy-connection") or header.lower().startswith("connection"):
-                continue
-            # make sure to always separate lines with CRLF 
-            forward_headers += header + "\r\n"
+        # build HTTP request (as bytes) and ignore proxy-specific headers
+        # along with the ones we always set ourselves below (so they aren't sent twice)
+        # lowercase just the start of each header once, then one startswith() checks every prefix in the tuple
+        request_lines = [f"{method} {path} HTTP/1.1".encode()]
+        request_lines += [header for header in headers if not header[:20].lower().startswith(STRIP_HEADERS)]
 
         # the mandatory headers to add in
-        forward_headers += f"Host: {host}\r\n"
-        forward_headers += "Connection: close\r\n"
-        forward_headers += "User-Agent: PythonProxy/1.0\r\n"
+        request_lines.append(f"Host: {host}".encode())
+        request_lines.append(b"Connection: close")
+        request_lines.append(b"User-Agent: PythonProxy/1.0")
 
-        full_request = request_line + forward_headers + "\r\n"
+        # make sure to always separate lines with CRLF (plus the blank line that ends the headers)
+        # joining the list once avoids rebuilding the string for every header
+        full_request = b"\r\n".join(request_lines) + b"\r\n\r\n"
 
-        # handle POST body (optional) 
+        # handle POST body (optional), already split off above and still raw bytes
         if method.upper() == "POST":
-            body_index = request.find("\r\n\r\n")
-            if body_index != -1:
-                body = request[body_index + 4:]
-                full_request += body
-
-        # remember to send in bytes (binary data) through socket to remote server here
-        server_sock.sendall(full_request.encode())
+            full_request += body
 
-        # receive the response from remote server in chunks (loop it)
-        response = b""
-        while True:
-            data = server_sock.recv(8192)
-            if not data:
-                break
-            response += data
+        # send the request through socket to remote server here
+        server_sock.sendall(full_request)
 
         # if its a GET method that client sent in, write remote server response to our cache_file
+        # while forwarding it to the client at the same time (chunk by chunk, the client doesn't wait for the whole thing)
         if method.upper() == "GET":
-            with open(cache_file, "wb") as f:
-                f.write(response)
+            # one reusable buffer that recv_into() fills, so no per-chunk bytes objects
+            scratch = bytearray(RECV_BUFFER)
+            mv = memoryview(scratch)
+            # write to a temporary name first so a half-received response never shows up as a cache hit
+            part_file = f"{cache_file}.{threading.get_ident()}.part"
+            try:
+                with open(part_file, "wb") as f:
+                    # receive the response from remote server in chunks (loop it)
+                    while True:
+                        n = server_sock.recv_into(mv)
+                        if not n:
+                            break
+                        chunk = mv[:n]
+                        f.write(chunk)
+                        client_sock.sendall(chunk)
+                        response_started = True
+                os.replace(part_file, cache_file)
+            except BaseException:
+                # transfer broke off part way (client reset, server timed out, ...), don't leave the partial copy behind
+                try:
+                    os.unlink(part_file)
+                except OSError:
+                    pass
+                raise
             print("[Cache] Saved")
+        # nothing to cache, so just pipe the response straight through to the client
+        else:
+            response_started = True
+            if hasattr(os, "splice"):
+                splice_relay(server_sock, client_sock)
+            else:
+                copy_relay(server_sock, client_sock)
 
-        # send back response to client socket and close socket we have with remote server
-        client_sock.sendall(response)
+        # close socket we have with remote server
         server_sock.close()
-    # catch any errors -> send error if possible
+    # catch any errors -> send error if possible (and only if the client hasn't started getting a response already)
     except Exception as e:
         print(f"[Error] {e}")
-        try:
-            client_sock.sendall(b"HTTP/1.1 500 Internal Server Error\r\n\r\n")
-        except:
-            pass
+        if not response_started:
+            try:
+                client_sock.sendall(b"HTTP/1.1 500 Internal Server Error\r\n\r\n")
+            except:
+                pass
     # we need to close our client socket (TCP connection)
     finally:
         client_sock.close()
@@ -168,7 +297,7 @@ def handle_client(client_sock, addr):
 
 # main function
 def main():
-    # Each client connects to the proxy server; handled in a separate thread and socket
+    # Each client connects to the proxy server; handled in a pool thread with its own socket
     # The proxy then opens its own socket to the target (remote) server on behalf of that client
 
     # argument run case
@@ -190,6 +319,10 @@ def main():
     tcpSerSock.settimeout(1.0)  
     print(f"[System] Proxy Server running on {SERVER_IP}:{SERVER_PORT}")
 
+    # threads are created once and reused for every client instead of spawning a new thread per connection
+    # this also caps how many threads a burst of connections can create
+    pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="proxy")
+
     # Main loop
     try:
         while True:
@@ -202,12 +335,15 @@ def main():
                 continue  
 
             print('[System] Ready to serve...')
-            # create a thread for each client and run handle_client()
-            threading.Thread(target=handle_client, args=(client_sock, addr), daemon=True).start()
+            # hand the client to a pool thread which runs handle_client()
+            pool.submit(handle_client, client_sock, addr)
     # close server socket and exit program
     except KeyboardInterrupt:
         print("\n[System] Shutting down proxy server...")
         tcpSerSock.close()
+        # drop clients still waiting in the queue, ones already being handled get to finish
+        # (at most CLIENT_TIMEOUT / SERVER_TIMEOUT after their connection goes quiet)
+        pool.shutdown(wait=False, cancel_futures=True)
         sys.exit(0)
 
 # main guard
@@ -14,8 +14,21 @@ import struct
 import time
 import select
 import socket
-# make HTTP requests
-import requests
+# saving geolocation results to disk
+import json
+# geolocation cache kept in least -> most recently used order
+from collections import OrderedDict
+# run the destination's geolocation lookup in the background while tracing
+from concurrent.futures import ThreadPoolExecutor, wait
+# recognizing private / special-use addresses (IPv6 and anything the fast IPv4 check can't parse)
+import ipaddress
+# guards creating the shared HTTP session (lookups can run on a background thread)
+import threading
+# optional: vectorized checksum
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # ICMP
 ICMP_ECHO_REQUEST = 8
@@ -26,119 +39,431 @@ ICMP_TIME_EXCEEDED = 11
 MAX_HOPS = 30
 TRIES = 2
 TIMEOUT = 2.0
+# size of the reusable ICMP receive buffer (one ethernet MTU)
+RECV_BUFFER_SIZE = 1500
 TCP_PORT = 80
+# precompiled struct formats (parsed once here instead of on every pack/unpack call)
+# ICMP header: type, code, checksum, ID, sequence
+ICMP_HEADER = struct.Struct('!BBHHH')
+# timestamp payload of our echo requests
+TIMESTAMP = struct.Struct('!d')
+# IP_TTL socket option value
+TTL_OPTION = struct.Struct('I')
+# protocol number for raw ICMP sockets (same value getprotobyname("icmp") looks up in /etc/protocols, just without the lookup)
+ICMP_PROTO = socket.IPPROTO_ICMP
+
+# geolocation cache (ip -> [time looked up, location]), kept on disk so repeated runs skip the HTTP lookup
+GEO_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "traceroute_geo.json")
+# how long a cached location is trusted (24 hours)
+GEO_CACHE_TTL = 24 * 60 * 60
+# most IPs kept in the cache, the least recently used ones get dropped past this
+GEO_CACHE_MAX = 4096
+# loaded from GEO_CACHE_FILE the first time it's needed
+geo_cache = None
+# lookups run on background threads too, so reading/changing the cache and writing the file happen under this lock
+geo_cache_lock = threading.Lock()
+
+# shared HTTP session for ip-api.com, created by get_session() the first time a lookup needs the network
+session = None
+session_lock = threading.Lock()
+
+# background threads for geolocation lookups, so the HTTP round trip overlaps with the trace itself
+geo_pool = ThreadPoolExecutor(max_workers=2)
+
+# IPv4 ranges ip-api.com can't locate (it just answers "fail"), as (network, mask) pairs
+# checked locally so these hops never cost an HTTP round trip
+PRIVATE_IPV4_RANGES = tuple(
+    (struct.unpack('!I', socket.inet_aton(net))[0], (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF)
+    for net, bits in (
+        ("10.0.0.0", 8),        # RFC1918
+        ("172.16.0.0", 12),     # RFC1918
+        ("192.168.0.0", 16),    # RFC1918
+        ("100.64.0.0", 10),     # carrier-grade NAT
+        ("169.254.0.0", 16),    # link-local
+        ("0.0.0.0", 8),         # "this network"
+        ("240.0.0.0", 4),       # reserved (and broadcast)
+    )
+)
 
 
 def checksum(data: bytes) -> int:
     if len(data) % 2:
         data += b'\x00'
-    s = 0
-    for i in range(0, len(data), 2):
-        w = (data[i] << 8) + (data[i + 1])
-        s += w
-        s &= 0xFFFFFFFF
-    s = (s >> 16) + (s & 0xFFFF)
-    s += s >> 16
+    if np is not None:
+        # sum every big-endian 16-bit word in one vectorized call
+        s = int(np.frombuffer(data, dtype='>u2').sum(dtype=np.uint64))
+    else:
+        # without NumPy: add 4 words at a time by reading big-endian 64-bit chunks (RFC 1071 trick),
+        # the carry folding below brings the sum back down to the same 16-bit result
+        # one struct call unpacks all the chunks, then the leftover (< 8 bytes) is added as 16-bit words
+        quads = len(data) // 8
+        s = sum(struct.unpack_from(f'!{quads}Q', data))
+        s += sum(struct.unpack_from(f'!{(len(data) - quads * 8) // 2}H', data, quads * 8))
+    # fold the carries back into the low 16 bits
+    while s >> 16:
+        s = (s >> 16) + (s & 0xFFFF)
     return ~s & 0xFFFF
 
-def get_location(ip: str) -> str:
-    # loopback recognition
-    if ip in ("*", "127.0.0.1"):
+# one shared session for every ip-api.com request, so the TCP connection is kept alive and reused
+# instead of setting up a new one (DNS lookup + handshake) per lookup; retries briefly on errors/rate limits
+# requests (and urllib3, certifi, etc.) is imported here instead of at the top since it takes a noticeable
+# moment to import, this way the trace starts right away and runs that only need cached/local lookups skip it
+def get_session():
+    global session
+    with session_lock:
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=16,
+                max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]),
+            ))
+            session.headers["Connection"] = "keep-alive"
+    return session
+
+# read the geolocation cache from disk (only once), missing or broken file -> start empty
+# the file is written in least -> most recently used order, so loading it into an OrderedDict keeps the LRU order
+def load_geo_cache() -> OrderedDict:
+    global geo_cache
+    with geo_cache_lock:
+        if geo_cache is None:
+            try:
+                with open(GEO_CACHE_FILE) as f:
+                    geo_cache = json.load(f, object_pairs_hook=OrderedDict)
+            except (OSError, ValueError):
+                geo_cache = OrderedDict()
+    return geo_cache
+
+# cached location for ip if it hasn't expired yet (and mark it as recently used), else None
+def cached_location(ip: str, now: float):
+    entry = geo_cache.get(ip)
+    if entry and now - entry[0] < GEO_CACHE_TTL:
+        geo_cache.move_to_end(ip)
+        return entry[1]
+    return None
+
+# add/refresh ip in the cache, dropping the least recently used IPs once it's over GEO_CACHE_MAX
+def cache_location(ip: str, location: str, now: float):
+    geo_cache[ip] = [now, location]
+    geo_cache.move_to_end(ip)
+    while len(geo_cache) > GEO_CACHE_MAX:
+        geo_cache.popitem(last=False)
+
+# write the geolocation cache back to disk (not being able to is not worth crashing over)
+# expired entries are dropped first so the file doesn't keep growing with locations nobody can use
+def save_geo_cache():
+    now = time.time()
+    for ip in [ip for ip, entry in geo_cache.items() if now - entry[0] >= GEO_CACHE_TTL]:
+        del geo_cache[ip]
+    try:
+        os.makedirs(os.path.dirname(GEO_CACHE_FILE), exist_ok=True)
+        with open(GEO_CACHE_FILE, "w") as f:
+            json.dump(geo_cache, f)
+    except OSError:
+        pass
+
+# turn one ip-api.com JSON result into a "city, region, country" string
+def format_location(data: dict) -> str:
+    if data.get("status") == "success":
+        city = data.get("city", "")
+        region = data.get("regionName", "")
+        country = data.get("country", "")
+        return f"{city}, {region}, {country}".strip(", ")
+    return "Location unknown"
+
+# returns "Localhost" / "Private network" for addresses that don't need a lookup, None for public ones
+def local_location(ip: str):
+    if ip == "*":
+        return "Localhost"
+    try:
+        # IPv4 fast path: one int and a few mask compares instead of building an IPv4Address object
+        addr = struct.unpack('!I', socket.inet_aton(ip))[0]
+    except OSError:
+        # not dotted IPv4 (IPv6 hop, ULA etc.), let ipaddress sort it out
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if addr.is_loopback:
+            return "Localhost"
+        if addr.is_private or addr.is_link_local or addr.is_reserved:
+            return "Private network"
+        return None
+    # 127.0.0.0/8
+    if addr >> 24 == 127:
         return "Localhost"
+    for network, mask in PRIVATE_IPV4_RANGES:
+        if addr & mask == network:
+            return "Private network"
+    return None
+
+def get_location(ip: str) -> str:
+    # loopback / private hops are answered locally (ip-api.com would just fail on them)
+    location = local_location(ip)
+    if location is not None:
+        return location
+    # cache hit that hasn't expired yet -> no network round trip at all
+    load_geo_cache()
+    with geo_cache_lock:
+        location = cached_location(ip, time.time())
+    if location is not None:
+        return location
     try:
         # HTTP GET to public IP geolocation API endpoint to aquire the city, region, and country info for given IP 
-        response = requests.get(f"http://ip-api.com/json/{ip}", timeout=2)
+        response = get_session().get(f"http://ip-api.com/json/{ip}", timeout=2)
         # get json data of it from response obj so that we can index the strings from dict
-        data = response.json()
-        if data["status"] == "success":
-            city = data.get("city", "")
-            region = data.get("regionName", "")
-            country = data.get("country", "")
-            return f"{city}, {region}, {country}".strip(", ")
-        else:
-            return "Location unknown"
+        location = format_location(response.json())
     except Exception:
+        # failures aren't cached so the next run tries again
         return "Lookup failed"
+    with geo_cache_lock:
+        cache_location(ip, location, time.time())
+        save_geo_cache()
+    return location
+
+# look up many IPs at once: cached ones are answered locally and the rest go out
+# in a single POST to ip-api.com's batch endpoint (up to 100 IPs per request) instead of one GET each
+# returns a dict of ip -> location
+def get_locations(ips) -> dict:
+    load_geo_cache()
+    now = time.time()
+    locations = {}
+    missing = []
+    # dict.fromkeys() drops duplicate IPs but keeps their order
+    for ip in dict.fromkeys(ips):
+        location = local_location(ip)
+        if location is None:
+            with geo_cache_lock:
+                location = cached_location(ip, now)
+        if location is not None:
+            locations[ip] = location
+        else:
+            missing.append(ip)
+
+    for i in range(0, len(missing), 100):
+        batch = missing[i:i + 100]
+        payload = [{"query": ip, "fields": "status,city,regionName,country"} for ip in batch]
+        try:
+            response = get_session().post("http://ip-api.com/batch", json=payload, timeout=5)
+            # results come back in the same order as the queries
+            results = response.json()
+            with geo_cache_lock:
+                for ip, data in zip(batch, results):
+                    locations[ip] = format_location(data)
+                    cache_location(ip, locations[ip], now)
+        except Exception:
+            for ip in batch:
+                locations[ip] = "Lookup failed"
+    if missing:
+        with geo_cache_lock:
+            save_geo_cache()
+    return locations
+
+# poll() avoids select()'s fd_set rebuild + scan on every call (and its 1024 fd limit)
+# Windows doesn't have select.poll(), so there we return None and fall back to select()
+def make_poller(sock):
+    if not hasattr(select, "poll"):
+        return None
+    poller = select.poll()
+    poller.register(sock.fileno(), select.POLLIN)
+    return poller
+
+# wait up to timeout seconds for sock to have something to read, returns False on timeout
+def wait_readable(poller, sock, timeout: float) -> bool:
+    if poller is not None:
+        # poll() takes milliseconds
+        return bool(poller.poll(timeout * 1000))
+    return bool(select.select([sock], [], [], timeout)[0])
+
+# start looking up the destination's location in the background as soon as we know its IP
+def start_location_lookup(dest_addr: str):
+    # load the cache here (main thread) so the worker thread and later lookups share the same dict
+    load_geo_cache()
+    return geo_pool.submit(get_location, dest_addr)
+
+# collect the result of start_location_lookup() once the destination actually replied
+def finish_location_lookup(geo_future, dest_addr: str, ip: str) -> str:
+    try:
+        location = geo_future.result(timeout=TIMEOUT)
+    except Exception:
+        location = "Lookup failed"
+    # the reply came from a different address than we resolved (rare), look that one up instead
+    # (after the background lookup is completely done, even if it ran past the timeout above)
+    if ip != dest_addr:
+        wait([geo_future])
+        location = get_location(ip)
+    return location
+
+# after a trace, geolocate every hop that answered in one go and print them as a table
+def print_hop_locations(hops):
+    if not hops:
+        return
+    locations = get_locations(ip for _, ip, _ in hops)
+    print("\nHop locations:")
+    for ttl, ip, rtt in hops:
+        print(f"{ttl:<2}\t{ip:<15}\t{round(rtt):>3} ms\t{locations.get(ip, 'Lookup failed')}")
 
 # build an ICMP Echo Request packet
-def build_icmp_packet(ID: int) -> bytes:
+def build_icmp_packet(ID: int, sequence: int = 1) -> bytes:
     # initially its zero
     my_checksum = 0
     # compute without correct checksum first
-    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, my_checksum, ID, 1)
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, my_checksum, ID, sequence)
     # pack (convert to binary data) our curr timestamp (used for RTT calculation with reply back)
-    data = struct.pack('!d', time.time())
+    data = TIMESTAMP.pack(time.time())
     # compute the ICMP checksum based on header and payload
     my_checksum = checksum(header + data)
     # repacked ICMP Echo request is now correct
-    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, my_checksum, ID, 1)
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, my_checksum, ID, sequence)
     # return header with payload
     return header + data
 
+# send one probe per TTL back to back on the same socket
+# the TTL goes in the ICMP sequence number, so each reply can be matched back to its hop
+# the sequence number carries both the retry round and the TTL (round << 8 | ttl), so a late reply to an
+# earlier round's probe can still be matched to the time that exact probe was sent
+def send_probes(my_socket, dest_addr: str, ID: int, ttls, round_no: int, sent_at: dict):
+    for ttl in ttls:
+        # set TTL
+        my_socket.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, TTL_OPTION.pack(ttl))
+        sequence = round_no << 8 | ttl
+        my_socket.sendto(build_icmp_packet(ID, sequence), (dest_addr, 0))
+        sent_at[sequence] = time.time()
+
+# figure out which of our probes a received packet answers
+# returns (icmp type, probe sequence number), or None if it isn't a reply to one of our probes
+def parse_reply(recv_packet, nbytes: int, ID: int):
+    # recv_packet is the reusable receive buffer, only its first nbytes are this packet
+    if nbytes < 20:
+        return None
+    # IP header length is the low 4 bits of the first byte, counted in 4 byte words
+    ip_header_len = (recv_packet[0] & 0x0F) * 4
+    if nbytes <= ip_header_len + 8:
+        return None
+    icmp_type = recv_packet[ip_header_len]
+    if icmp_type == ICMP_ECHO_REPLY:
+        # the destination echoes our ID and sequence number straight back
+        offset = ip_header_len
+    elif icmp_type == ICMP_TIME_EXCEEDED:
+        # routers quote our original packet after their own 8 byte ICMP header:
+        # our IP header first, then the start of our echo request (which has the ID and sequence)
+        inner = ip_header_len + 8
+        offset = inner + (recv_packet[inner] & 0x0F) * 4
+    else:
+        return None
+    if nbytes < offset + ICMP_HEADER.size:
+        return None
+    # read the header straight out of the packet (no slice copy)
+    _, _, _, packet_id, sequence = ICMP_HEADER.unpack_from(recv_packet, offset)
+    if packet_id != ID:
+        return None
+    return icmp_type, sequence
+
 def icmp_trace(hostname):
     # returns the IP address of website given
     # not to be confused with .gethostname(), which returns machine hostname
     dest_addr = socket.gethostbyname(hostname)
     print(f"Tracing route to {hostname} [{dest_addr}] via ICMP:\n")
+    geo_future = start_location_lookup(dest_addr)
 
-    reached = False
-    for ttl in range(1, MAX_HOPS + 1):
+    # .SOCK_RAW allows for sending raw packets (admin access required)
+    # one socket for the whole trace, only its TTL changes between probes (instead of a new socket per probe)
+    try:
+        my_socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, ICMP_PROTO)
+    except PermissionError:
+        print("Permission denied. Run with admin/root.")
+        return False
+    # wait TIMEOUT seconds for a reply back
+    my_socket.settimeout(TIMEOUT)
+    poller = make_poller(my_socket)
+    # one receive buffer for the whole trace (big enough for a full ethernet frame),
+    # replies are read into it instead of allocating a new bytes object per packet
+    recv_buffer = bytearray(RECV_BUFFER_SIZE)
+    recv_view = memoryview(recv_buffer)
+    # get process ID as unique identifier
+    ID = os.getpid() & 0xFFFF
+
+    # instead of probing one TTL at a time (waiting up to TIMEOUT on each), every TTL is probed at once
+    # and replies are collected for TIMEOUT seconds, so the whole trace takes about one timeout per try
+    # ttl -> (ip, rtt, icmp type) for every hop that answered
+    results = {}
+    # TTL the destination itself answered at (None until it does)
+    dest_ttl = None
+    # sequence number -> time that probe was sent at, kept across rounds so late replies are timed against their own probe
+    sent_at = {}
+    try:
         for tries in range(TRIES):
-            # .SOCK_RAW allows for sending raw packets (admin access required)
-            # told to use ICMP protocol with .getprotobyname() (returns a constant value of 7)
-            with socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.getprotobyname("icmp")) as my_socket:
-                # set TTL
-                my_socket.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, struct.pack('I', ttl))
-                # wait TIMEOUT seconds for a reply back
-                my_socket.settimeout(TIMEOUT)
-                # get process ID as unique identifier
-                ID = os.getpid() & 0xFFFF
-                # create the packet
-                packet = build_icmp_packet(ID)
-                # time before sending
-                start_time = time.time()
-                try:
-                    # send packet and wait for socket to become readable
-                    my_socket.sendto(packet, (hostname, 0))
-                    ready = select.select([my_socket], [], [], TIMEOUT)
-                    # no packet back -> timeout
-                    if not ready[0]:
-                        raise socket.timeout
-
-                    # recieve back packet and extract info
-                    recv_packet, addr = my_socket.recvfrom(1024)
-                    time_received = time.time()
-                    icmp_header = recv_packet[20:28] 
-                    icmp_type, code, _, _, _ = struct.unpack("!BBHHH", icmp_header)
-                    rtt = (time_received - start_time) * 1000
-
-                    ip = addr[0]
-                    if icmp_type == ICMP_TIME_EXCEEDED:
-                        # intermediate hop —> just print IP, no geolocation
-                        print(f"{ttl:<2}\t{ip:<15}\t{round(rtt):>3} ms")
-                        break
-                    elif icmp_type == ICMP_ECHO_REPLY:
-                        # final destination —> do geo lookup
-                        location = get_location(ip)
-                        # output to terminal (use alignment, rounding for RTT, and tabbing)
-                        print(f"{ttl:<2}\t{ip:<15}\t{round(rtt):>3} ms\t{location} (destination)")
-                        reached = True
-                        return reached
-                    
-                # timeout reached or not admin:
-                except socket.timeout:
-                    if tries == TRIES - 1:
-                        print(f"{ttl:<2}\t*\tRequest timed out.")
-                except PermissionError:
-                    print("Permission denied. Run with admin/root.")
-                    return False
+            # (re)probe every TTL still missing an answer, nothing past the destination once we know where it is
+            pending = {ttl for ttl in range(1, (dest_ttl or MAX_HOPS) + 1) if ttl not in results}
+            if not pending:
+                break
+            send_probes(my_socket, dest_addr, ID, sorted(pending), tries, sent_at)
+            deadline = time.time() + TIMEOUT
+            while pending:
+                time_left = deadline - time.time()
+                # no packet back in time -> the rest of this round timed out
+                if time_left <= 0 or not wait_readable(poller, my_socket, time_left):
+                    break
+
+                # recieve back packet and extract info
+                nbytes, addr = my_socket.recvfrom_into(recv_view, RECV_BUFFER_SIZE)
+                time_received = time.time()
+                reply = parse_reply(recv_view, nbytes, ID)
+                if reply is None:
+                    continue
+                icmp_type, sequence = reply
+                ttl = sequence & 0xFF
+                if sequence not in sent_at or ttl in results:
+                    continue
+                rtt = (time_received - sent_at[sequence]) * 1000
+                results[ttl] = (addr[0], rtt, icmp_type)
+                pending.discard(ttl)
+                if icmp_type == ICMP_ECHO_REPLY and (dest_ttl is None or ttl < dest_ttl):
+                    # final destination, the hops after it don't matter anymore
+                    dest_ttl = ttl
+                    pending = {t for t in pending if t < ttl}
+    # not admin:
+    except PermissionError:
+        print("Permission denied. Run with admin/root.")
+        return False
+    finally:
+        if poller is not None:
+            poller.unregister(my_socket.fileno())
+        my_socket.close()
+
+    # every hop that answered as (ttl, ip, rtt), geolocated together once the trace is done
+    hops = []
+    for ttl in range(1, (dest_ttl or MAX_HOPS) + 1):
+        if ttl not in results:
+            # timeout reached
+            print(f"{ttl:<2}\t*\tRequest timed out.")
+            continue
+        ip, rtt, icmp_type = results[ttl]
+        hops.append((ttl, ip, rtt))
+        if icmp_type == ICMP_ECHO_REPLY:
+            # final destination —> geo lookup (already running in the background, usually done by now)
+            location = finish_location_lookup(geo_future, dest_addr, ip)
+            # output to terminal (use alignment, rounding for RTT, and tabbing)
+            print(f"{ttl:<2}\t{ip:<15}\t{round(rtt):>3} ms\t{location} (destination)")
+        else:
+            # intermediate hop —> just print IP for now, geolocation comes after the trace
+            print(f"{ttl:<2}\t{ip:<15}\t{round(rtt):>3} ms")
+
+    # the background lookup writes to the same cache, so let it finish first
+    wait([geo_future])
+    print_hop_locations(hops)
     # for our fallback
-    return reached
+    return dest_ttl is not None
 
 def tcp_trace(hostname):
     # A TCP-based traceroute 
     dest_addr = socket.gethostbyname(hostname)
     print(f"\nSwitching to TCP traceroute on port {TCP_PORT}:\n")
+    geo_future = start_location_lookup(dest_addr)
 
     for ttl in range(1, MAX_HOPS + 1):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP) as tcp_socket:
@@ -150,7 +475,7 @@ def tcp_trace(hostname):
                 tcp_socket.connect((dest_addr, TCP_PORT))
                 rtt = (time.time() - start_time) * 1000
                 # only for final destination
-                location = get_location(dest_addr)  
+                location = finish_location_lookup(geo_future, dest_addr, dest_addr)
                 print(f"{ttl:<2}\t{dest_addr:<15}\t{round(rtt):>3} ms\t{location} (destination)")
                 return
 
@@ -3,12 +3,45 @@
 # defaulting to "from socket import *" gives me a wildcard import error,
 # so it is not included
 import socket
+# fstat() for the size of the file being served
+import os
+# optional prefork worker count from the command line
+import sys
+# ctrl + C handling without an accept() timeout
+import signal
+import threading
+# serving several clients at once: selector for the listening socket, worker threads for the clients
+import selectors
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+# LRU cache of small files
+from collections import OrderedDict
 
 # Server configuration (what port server listens on, socket creation)
 # .AF_NET means we are using IPV4 addressing, and:
 # .SOCK_STREAM -> TCP, .SOCK_DGRAM -> UDP
 serverPort = 6789
+# how many clients can be served at the same time
+MAX_WORKERS = 16
+# seconds a client connection can sit idle (waiting on its request or on it reading our response) before we drop it
+CLIENT_TIMEOUT = 5.0
+# most bytes of a request we read (the request line + headers, we don't take request bodies)
+REQUEST_BUFFER_SIZE = 4096
+# folder the server serves files from (the one it was started in), resolved once at startup
+DOCROOT = os.path.realpath('.')
+# every file we serve has to live under DOCROOT
+VALID_PREFIX = os.path.join(DOCROOT, '')
+# files up to this size are kept in memory after the first request, bigger ones are sent with sendfile() every time
+CACHE_MAX_FILE_SIZE = 64 * 1024
+# most files kept in the in-memory cache
+FILE_CACHE_ENTRIES = 128
 serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+# let the server rebind its port right after a restart instead of failing with "address already in use"
+# while the old connections sit in TIME_WAIT
+serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+# SO_REUSEPORT doesn't exist on every OS (Windows), so only set it when it's there
+if hasattr(socket, "SO_REUSEPORT"):
+    serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
 # Prepare the server socket:
 # bind the socket to all interfaces (where to listen in on)
@@ -17,92 +50,297 @@ serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 serverSocket.bind(('', serverPort)) 
 # make the socket listen for incoming connections/requests (a passive socket)
 # set max length for incoming connection queue within the method parameter
-serverSocket.listen(1)
-# we set a timeout, so that:
-# if no TCP connection after 1 second when .accept() keeps blocking -> we bypass it
-serverSocket.settimeout(1.0)
+# (room for a full pool's worth of clients to queue up now that they're served concurrently)
+serverSocket.listen(MAX_WORKERS)
 
-# startup server msg
-print(f"Server started on port {serverPort}...")
+# ctrl + C: instead of waking up every second (accept() timeout) just to check for a KeyboardInterrupt,
+# the main loop blocks for real and the SIGINT handler sets stop; the signal also writes a byte into a
+# wakeup pipe the selector watches (see serve_forever), which wakes the blocked wait up right away and the loop ends
+stop = threading.Event()
 
-try:
-    # we need to continuously accept and handle connections
-    while True:
-        # (ctrl + C) could work fine without this try-except block with timeout, did not work for me however 
-        # could remove this try-except and just stop the terminal, or use other threading workarounds but that is too complex for this server
-        try:
-            # accept any incoming connections and store: (connection socket, client IP address)
-            # a new socket (connectionSocket) is used to send/recieve with that particular client
-            # .accept() blocks further execution and waits until given TCP connection or socket closes
-            # learned a new thing about python today, the unpacking operator (*)!
-            connectionSocket, addr = serverSocket.accept()
-            print(f"Connection from {addr}")
+def handle_sigint(signum, frame):
+    stop.set()
+    # a second ctrl + C goes back to python's default behavior (KeyboardInterrupt) in case shutting down gets stuck
+    signal.signal(signal.SIGINT, signal.default_int_handler)
 
+signal.signal(signal.SIGINT, handle_sigint)
+# (ctrl + C) doesn't interrupt a blocking wait on Windows, so there we keep the old 1 second timeout:
+# if no TCP connection after 1 second -> we bypass it and check stop
+SELECT_TIMEOUT = None
+if os.name == "nt":
+    serverSocket.settimeout(1.0)
+    SELECT_TIMEOUT = 1.0
 
-            # you initialize it here before the try to avoid "possibly unbound" warnings
-            # this avoids referencing it in the except clause before it is actually assigned a value
-            filename = None  
-            try:
-                # receive the GET HTTP request (sent through a browser from the client) through the connection socket
-                # recv() also has blocking behavior like .accept() and returns bytes
-                # within the parameter -> how many bytes to read from TCP stream
-                # decode() converts the bytes back into string using utf-8 (decode() default) which is good enough 
-                # improvements: switching decode to use a different encoding format
-                # improvements: reading whole msg instead of just fixed number of bytes (keep reading until end of HTTP header is detected "\r\n\r\n")
-                message = connectionSocket.recv(1024).decode()
-                print(f"Request: {message}")
-
-                # split HTTP request into tokens
-                parts = message.split()
-                # either request is incorrect or server read it incorrectly
-                # should read something like this: [GET, path, HTTPVER, etc.]
-                if len(parts) < 2:
-                    raise IOError("Malformed request")
-                filename = parts[1]  # ex: "/index.html"
-
-                # I'll also say that the home page will route you to the index.html path
-                if filename == '/':
-                    filename = '/index.html'
-
-                # open the file associated to page pathway within HTTP request
-                # I already gave an html file to be read in curr folder
-                with open(filename[1:], 'r') as f:
-                    outputdata = f.read()
+# response headers, built once here instead of on every request
+# (%d gets filled in with the body length, so the browser knows exactly where the response ends)
+HEADER_200 = b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+BODY_404 = b'404 Not Found: The requested file was not found on this server.'
+RESPONSE_404 = (b'HTTP/1.1 404 Not Found\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' % len(BODY_404)) + BODY_404
+
+# in-memory cache of small files: path -> ((mtime, size) when read, full HTTP response)
+# an OrderedDict keeps it in least -> most recently used order, so the oldest entry is the one dropped when it's full
+file_cache = OrderedDict()
+# requests are served from several threads at once
+file_cache_lock = threading.Lock()
+
+# returns the full 200 response (header + body) for a small file, re-reading it only if it changed on disk
+def cached_response(path, st):
+    version = (st.st_mtime_ns, st.st_size)
+    with file_cache_lock:
+        entry = file_cache.get(path)
+        if entry is not None and entry[0] == version:
+            file_cache.move_to_end(path)
+            return entry[1]
+    # not cached yet (or the file was modified since), read it outside the lock so other requests aren't held up
+    with open(path, 'rb') as f:
+        body = f.read()
+    response = HEADER_200 % len(body) + body
+    with file_cache_lock:
+        file_cache[path] = (version, response)
+        file_cache.move_to_end(path)
+        if len(file_cache) > FILE_CACHE_ENTRIES:
+            file_cache.popitem(last=False)
+    return response
+
+# handles one client connection start to finish (runs on a worker thread from the pool)
+def handle_client(connectionSocket, addr):
+    print(f"Connection from {addr}")
+
+    # you initialize it here before the try to avoid "possibly unbound" warnings
+    # this avoids referencing it in the except clause before it is actually assigned a value
+    filename = None  
+    try:
+        # send small response pieces right away instead of letting Nagle's algorithm hold them back waiting for ACKs
+        # (inside the try so the socket still gets closed if the client already reset the connection)
+        connectionSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # give up on clients that go quiet (browsers open "preconnect" sockets and never send anything on them),
+        # otherwise this thread would sit in recv forever and ctrl + C could never finish shutting down
+        connectionSocket.settimeout(CLIENT_TIMEOUT)
+
+        # receive the GET HTTP request (sent through a browser from the client) through the connection socket
+        # recv_into() also has blocking behavior like .accept(), it fills our buffer in place instead of returning new bytes
+        # the request can arrive split over several TCP segments, so keep reading until the end of the HTTP header
+        # is detected ("\r\n\r\n") or the buffer is full (we only ever need the request line anyway)
+        request = bytearray(REQUEST_BUFFER_SIZE)
+        view = memoryview(request)
+        nbytes = 0
+        while nbytes < REQUEST_BUFFER_SIZE:
+            received = connectionSocket.recv_into(view[nbytes:])
+            # client closed its side
+            if not received:
+                break
+            nbytes += received
+            # only search the new data (plus 3 bytes before it in case the "\r\n\r\n" got split between reads)
+            if request.find(b"\r\n\r\n", max(0, nbytes - received - 3), nbytes) != -1:
+                break
+
+        # the request line is everything up to the first CRLF: "GET /index.html HTTP/1.1"
+        line_end = request.find(b"\r\n", 0, nbytes)
+        request_line = bytes(view[:nbytes if line_end == -1 else line_end])
+        print(f"Request: {request_line.decode('ascii', 'replace')}")
+
+        # split the request line into tokens straight from the bytes (the headers after it are never decoded)
+        parts = request_line.split(b' ', 2)
+        # either request is incorrect or server read it incorrectly
+        # should read something like this: [GET, path, HTTPVER]
+        if len(parts) < 2:
+            raise IOError("Malformed request")
+        # only the path gets decoded (paths are plain ASCII, anything else just won't match a file -> 404)
+        filename = parts[1].decode('ascii', 'replace')  # ex: "/index.html"
+
+        # I'll also say that the home page will route you to the index.html path
+        if filename == '/':
+            filename = '/index.html'
+
+        # the file associated to page pathway within HTTP request
+        # I already gave an html file to be read in curr folder
+        # resolved to an absolute path (symlinks and ".." included) which also becomes the cache key
+        path = os.path.realpath(os.path.join(DOCROOT, filename.lstrip('/')))
+        # anything that resolves outside the folder we serve ("/../../etc/passwd") is treated as not found
+        if not path.startswith(VALID_PREFIX):
+            raise IOError("Path outside document root")
+        # one stat() tells us the size (which way to send it) and the mtime (whether a cached copy is still current)
+        st = os.stat(path)
+        if st.st_size <= CACHE_MAX_FILE_SIZE:
+            # small file: the whole response comes out of the in-memory cache (no open/read at all on a hit)
+            # and goes out in a single sendall() (keeps going until every byte is out, send() alone can stop part way)
+            connectionSocket.sendall(cached_response(path, st))
+        else:
+            # big file: not worth keeping in memory, stream it from disk instead
+            # opened as raw bytes ('rb') since sendfile() hands the file to the socket as is
+            with open(path, 'rb') as f:
+                # file size straight from the OS (no reading the file into memory just to measure it)
+                size = os.fstat(f.fileno()).st_size
 
                 # send response HTTP header into socket
-                # remember to encode back into bytes for TCP stream
                 # learned today: CRLF -> Carriage Return Line Feed -> '/r/n'
                 # carriage returns move cursor to the start of the current line, while line feeds move the cursor down a line
-                header = 'HTTP/1.1 200 OK\r\n\r\n'
-                connectionSocket.send(header.encode())
-
-                # send the content of requested file to client 
-                # remember to encode since data read from file is a string
-                # added 1 CRLF instead of 2 here since this is the body of HTTP response 
-                connectionSocket.send(outputdata.encode())
-                connectionSocket.send("\r\n".encode())
-
-            # to catch the cases where file can't be read (not a valid path/page on server (404 response) or favicon)
-            except IOError:
-                # if HTTP request wants a favicon (little image on browser tab)
-                if filename == '/favicon.ico':
-                    # we simply ignore the request
-                    pass
-                else:
-                    header = 'HTTP/1.1 404 Not Found\r\n\r\n'
-                    body = '404 Not Found: The requested file was not found on this server.'
-                    connectionSocket.send(header.encode())
-                    connectionSocket.send(body.encode())
-            finally:
-                # for each TCP connection to a client, we need to close it's socket
-                connectionSocket.close()
-        # if timeout is hit/reached we skip the blocking going to next loop (interpeter can then notice a KeyBoardInterrupt) 
-        except socket.timeout:
-            continue
+                connectionSocket.sendall(HEADER_200 % size)
+                # send the content of requested file to client
+                # sendfile() lets the kernel copy the file from the page cache straight into the socket (sendfile(2) on Linux),
+                # no copy of it ever goes through python (falls back to a plain read/send loop on other OSes)
+                connectionSocket.sendfile(f)
+
+    # client didn't send its request (or stopped reading the response) in time, just drop the connection
+    except socket.timeout:
+        pass
+    # to catch the cases where file can't be read (not a valid path/page on server (404 response) or favicon)
+    except IOError:
+        # if HTTP request wants a favicon (little image on browser tab)
+        if filename == '/favicon.ico':
+            # we simply ignore the request
+            pass
+        else:
+            connectionSocket.sendall(RESPONSE_404)
+    finally:
+        # for each TCP connection to a client, we need to close it's socket
+        connectionSocket.close()
+
+
+# pool callback: a connection still queued when the pool shuts down gets cancelled and never reaches
+# handle_client (whose finally would close it), so close it here instead of leaving the client hanging
+def close_if_cancelled(connectionSocket, future):
+    if future.cancelled():
+        connectionSocket.close()
+
+# accept and serve connections in this process until ctrl + C sets stop
+def serve_forever():
+    # the selector watches the listening socket for new connections (DefaultSelector picks epoll on Linux, kqueue on macOS/BSD)
+    # and every accepted connection is handed off to a pool of worker threads,
+    # so one slow client no longer holds up everybody else behind it
+    sel = selectors.DefaultSelector()
+    sel.register(serverSocket, selectors.EVENT_READ)
+    # every signal writes a byte into this pipe, and the selector watches its read end,
+    # so ctrl + C always wakes sel.select() up (otherwise python just retries the wait after running the handler)
+    # Windows can't select() on a pipe, it relies on the 1 second timeout instead
+    wake_r = wake_w = None
+    if os.name != "nt":
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_r, False)
+        os.set_blocking(wake_w, False)
+        signal.set_wakeup_fd(wake_w)
+        sel.register(wake_r, selectors.EVENT_READ)
+    pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+    try:
+        # we need to continuously accept and handle connections (until ctrl + C sets stop)
+        while not stop.is_set():
+            # blocks until a connection is waiting or a signal arrives (Windows: at most 1 second, see the timeout above)
+            events = sel.select(timeout=SELECT_TIMEOUT)
+            if not any(key.fileobj is serverSocket for key, _ in events):
+                # woken by a signal (or the Windows timeout): empty the pipe, then the loop checks stop
+                if wake_r is not None:
+                    try:
+                        os.read(wake_r, 512)
+                    except BlockingIOError:
+                        pass
+                continue
+            try:
+                # accept any incoming connections and store: (connection socket, client IP address)
+                # a new socket (connectionSocket) is used to send/recieve with that particular client
+                # learned a new thing about python today, the unpacking operator (*)!
+                connectionSocket, addr = serverSocket.accept()
+                # prefork puts the listening socket in non-blocking mode, and on macOS/BSD the accepted socket
+                # inherits that (python only undoes it when the listener has a timeout), so switch it back explicitly
+                connectionSocket.setblocking(True)
+            # Windows only (see the timeout above): nothing connected yet, go around and check stop again
+            # prefork: another worker process got to this connection first
+            except (socket.timeout, BlockingIOError):
+                continue
+            # listening socket is gone
+            except OSError:
+                break
+            future = pool.submit(handle_client, connectionSocket, addr)
+            future.add_done_callback(partial(close_if_cancelled, connectionSocket))
+    finally:
+        # let requests already being served finish (each is bounded by CLIENT_TIMEOUT, so an idle client can't hold this up forever)
+        # and drop connections still waiting in the queue for a free thread
+        # (in a finally so this still happens when a second ctrl + C raises KeyboardInterrupt out of the loop)
+        pool.shutdown(wait=True, cancel_futures=True)
+        sel.close()
+        if wake_r is not None:
+            signal.set_wakeup_fd(-1)
+            os.close(wake_r)
+            os.close(wake_w)
+
+# prefork: worker process pids still running (only used by the parent)
+children = set()
+
+# SIGCHLD: collect every worker process that exited so it doesn't linger as a zombie
+def reap_children(signum, frame):
+    while True:
+        try:
+            # WNOHANG -> don't block if the others are still running
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            break
+        children.discard(pid)
+
+# optional prefork mode: "python WebServer.py 4" runs 4 worker processes that all accept on the same
+# inherited listening socket (the kernel hands each new connection to one of them), so requests get
+# spread over several cores instead of sharing one process (and its GIL)
+# needs os.fork(), so it's not available on Windows
+num_processes = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+if num_processes > 0 and not hasattr(os, "fork"):
+    print("Prefork workers need os.fork() (not available on Windows), serving from a single process")
+    num_processes = 0
+
+# startup server msg
+print(f"Server started on port {serverPort}...")
+
+if num_processes > 0:
+    # every worker waits on the same socket, so whoever loses the race for a connection
+    # gets an error back from .accept() right away instead of blocking
+    serverSocket.setblocking(False)
+    signal.signal(signal.SIGCHLD, reap_children)
+    # hold SIGCHLD back while forking: a worker that dies right away would otherwise get reaped
+    # before its pid is even added to children, and we'd wait on it forever
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGCHLD})
+    for _ in range(num_processes):
+        pid = os.fork()
+        if pid == 0:
+            # worker: serve until ctrl + C, then exit without running the parent's code below
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+            serve_forever()
+            os._exit(0)
+        children.add(pid)
+    print(f"Started {num_processes} worker processes")
+
+    # every signal also writes a byte into this pipe, so the parent can sleep on a read from it:
+    # unlike signal.pause(), a signal landing between the loop check and the wait still wakes it up
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    # any SIGCHLD from workers that already exited gets delivered (and reaped) now
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+
+    # the parent only supervises: sleep until a signal arrives (ctrl + C or a worker exiting)
+    while children and not stop.is_set():
+        os.read(wake_r, 512)
+    signal.set_wakeup_fd(-1)
+    os.close(wake_r)
+    os.close(wake_w)
+    # ctrl + C in the terminal reaches every worker already, but a kill sent to just the parent doesn't
+    for pid in list(children):
+        try:
+            os.kill(pid, signal.SIGINT)
+        except ProcessLookupError:
+            pass
+    # wait for the workers to finish their last requests
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    while True:
+        try:
+            os.wait()
+        except ChildProcessError:
+            break
+else:
+    serve_forever()
+
 # for user termination of server (ctrl + C)
-except KeyboardInterrupt:
-    print("\nServer shutting down...")
+print("\nServer shutting down...")
 
 # close our listening server socket (deallocates it and releases port/OS resources for other processes to use)
 serverSocket.close()
-